@@ -4,40 +4,242 @@ AI Receipt Processing Script
 This script processes receipt images and extracts structured data using OCR and NLP.
 """
 
+from __future__ import annotations
+
 import sys
 import json
 import os
-import cv2
-import numpy as np
-import pytesseract
+
+# Tesseract's own OpenMP threading slows down single-image OCR; batches are
+# parallelised across processes instead. Must be set before libtesseract loads.
+os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
 from datetime import datetime
 import re
 import argparse
-from typing import Dict, List, Optional
+import multiprocessing
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+# cv2, numpy and tesserocr are imported where they are used, so one-shot CLI
+# runs (and --help) do not pay for loading them up front
+if TYPE_CHECKING:
+    import numpy as np
+
+try:
+    import orjson
+except ImportError:  # optional faster encoder; fall back to the stdlib json
+    orjson = None
+
+# Longest image edge, in pixels, passed on to OCR
+_MAX_IMAGE_EDGE = 1600
+
+# Number of distinct OCR texts whose parse results each processor keeps
+_PARSE_CACHE_SIZE = 128
+
+# Parsing patterns, compiled once at import time
+# Date fields limited to valid ranges, so OCR digit noise never reaches strptime
+_DAY = r'(?:0?[1-9]|[12]\d|3[01])'
+_MONTH = r'(?:0?[1-9]|1[0-2])'
+_MONTH_NAME = r'(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*'
+
+_DATE_UNION = re.compile(
+    r'\b(?P<iso>\d{4}-' + _MONTH + '-' + _DAY + r')\b'                   # YYYY-MM-DD
+    r'|\b(?P<slash>' + _DAY + '/' + _DAY + r'/(?:\d{4}|\d{2}))\b'        # MM/DD or DD/MM, YY or YYYY
+    r'|\b(?P<dash>' + _DAY + '-' + _DAY + r'-(?:\d{4}|\d{2}))\b'         # MM-DD or DD-MM, YY or YYYY
+    r'|\b(?P<mon1>' + _MONTH_NAME + ' ' + _DAY + r',? \d{4})\b'
+    r'|\b(?P<mon2>' + _DAY + ' ' + _MONTH_NAME + r' \d{4})\b',
+    re.IGNORECASE
+)
+
+# strptime format for each _DATE_UNION group
+_DATE_FORMATS = {
+    'iso': '%Y-%m-%d',
+    'slash': '%m/%d/%Y',
+    'dash': '%m-%d-%Y',
+    'mon1': '%b %d %Y',
+    'mon2': '%d %b %Y',
+}
+
+_DAY_FIRST_FORMATS = {
+    'slash': '%d/%m/%Y',
+    'dash': '%d-%m-%Y',
+}
+
+# Company/business name lines, also searched beyond the top of the receipt
+_VENDOR_NAME_PATTERNS = (
+    r'^(?P<company>[A-Z][a-z]+(?:[ \t]+[A-Z][a-z]+)*[ \t]+(?:Inc|LLC|Corp|Ltd|Pty))\b',
+    r'^(?P<business>[A-Z][a-z]+(?:[ \t]+[A-Z][a-z]+)*[ \t]+(?:Restaurant|Cafe|Store|Market|Shop))\b',
+)
+
+_VENDOR_UNION = re.compile('|'.join((
+    r'\b(?i:vendor|merchant|store|restaurant|cafe|shop)\b:?[ \t]*(?P<labelled>\S.*)',
+    r'\b(?i:thank you|visit again|welcome to)\b[ \t]*(?P<greeting>\S.*)',
+) + _VENDOR_NAME_PATTERNS), re.MULTILINE)
+
+_VENDOR_NAME_UNION = re.compile('|'.join(_VENDOR_NAME_PATTERNS), re.MULTILINE)
+
+# Number of leading lines searched for the vendor before the rest of the text
+_VENDOR_HEAD_LINES = 4
+
+_TOTAL_UNION = re.compile(
+    r'\b(?:total|amount|balance|due):?\s*[\$€£]?\s*(?P<total>[\d,]+\.\d{2})'
+    r'|[\$€£]?\s*(?P<total_before>[\d,]+\.\d{2})[ \t]*(?:total|due|balance)',
+    re.IGNORECASE
+)
+
+_PAYMENT_RE = re.compile(
+    r'\b(?P<payment>cash|credit|debit|visa|mastercard|amex|discover|paypal|venmo|apple pay|google pay|mobile pay)\b',
+    re.IGNORECASE
+)
+
+_AMOUNT_FALLBACK = re.compile(r'[\$€£]?\s*(?P<amount>[\d,]+\.\d{2})')
+
+# Date, total, payment and amount patterns fused into one alternation so
+# scan_fields() reads all of them in a single pass; each match is classified
+# by the name of the group it landed in. Earlier alternatives win at any
+# given position, so totals are tried before bare amounts.
+_FIELDS_UNION = re.compile(
+    '|'.join(pattern.pattern for pattern in (_DATE_UNION, _TOTAL_UNION, _PAYMENT_RE, _AMOUNT_FALLBACK)),
+    re.IGNORECASE
+)
+
+_TOTAL_GROUPS = ('total', 'total_before')
+
+# Thousands separators dropped before float()
+_STRIP_COMMAS = str.maketrans('', '', ',')
+
+# Description length limit shared by the item slicer and _ITEM_PATTERN
+_ITEM_DESCRIPTION_MAX = 41
+
+# Anchored at both ends with a bounded description so a near-miss fails fast
+# instead of backtracking through every letter/space split of the line.
+# ASCII-only, like the slicer in _split_item_line.
+_ITEM_PATTERN = re.compile(
+    r'^([A-Za-z][A-Za-z ]{0,%d}?)\s+(\d+)\s+@\s+[\$€£]?\s*([\d,]+\.\d{2})\s+[\$€£]?\s*([\d,]+\.\d{2})$'
+    % (_ITEM_DESCRIPTION_MAX - 1),
+    re.ASCII
+)
+
+def _normalise_date(kind: str, date_str: str) -> Optional[str]:
+    """Convert a date matched by a _DATE_UNION group to YYYY-MM-DD"""
+    fmt = _DATE_FORMATS[kind]
+
+    if kind in _DAY_FIRST_FORMATS:
+        first, second, year = date_str.split(fmt[2])
+        if int(first) > 12:
+            if int(second) > 12:
+                return None
+            # Day-first layout such as 25/12/2023
+            fmt = _DAY_FIRST_FORMATS[kind]
+        if len(year) == 2:
+            fmt = fmt.replace('%Y', '%y')
+    elif kind in ('mon1', 'mon2'):
+        # Reduce spelled-out months ("January", "Sept") to %b abbreviations
+        date_str = ' '.join(
+            word[:3] if word.isalpha() else word
+            for word in date_str.replace(',', '').split()
+        )
+
+    try:
+        parsed = datetime.strptime(date_str, fmt)
+    except ValueError:
+        # Only reachable for days past the end of the month, e.g. 02/30
+        return None
+
+    return parsed.strftime('%Y-%m-%d')
+
+def _amount_value(amount_str: str) -> float:
+    """Convert a matched amount such as "1,234.50" to a float"""
+    # The patterns only capture digits, commas and two decimals
+    return float(amount_str.translate(_STRIP_COMMAS))
+
+def _price_value(token: str) -> Optional[float]:
+    """Parse a price token such as "$1,234.50", or return None if it is not one"""
+    # At most one currency symbol, as in _ITEM_PATTERN's [\$€£]?
+    if token[:1] in ('$', '€', '£'):
+        token = token[1:]
+    whole, dot, cents = token.rpartition('.')
+    digits = whole.translate(_STRIP_COMMAS)
+    if (dot and whole and len(cents) == 2 and (whole + cents).isascii()
+            and cents.isdigit() and (not digits or digits.isdigit())):
+        return float(f'{digits}.{cents}')
+    return None
+
+def _split_item_line(line: str) -> Optional[Tuple[str, int, float, float]]:
+    """Parse a "description qty @ unit total" line by slicing it at the '@' column"""
+    head, _, tail = line.partition('@')
+    head_fields = head.rsplit(None, 1)
+    prices = tail.split()
+    if len(head_fields) != 2 or len(prices) != 2:
+        return None
+
+    # Same language as _ITEM_PATTERN: ASCII letters and spaces, bounded lengths
+    description, quantity = head_fields
+    if (len(description) > _ITEM_DESCRIPTION_MAX
+            or not (description + quantity).isascii()
+            or not description.replace(' ', '').isalpha() or not quantity.isdigit()):
+        return None
+
+    unit_price = _price_value(prices[0])
+    total_price = _price_value(prices[1])
+    if unit_price is None or total_price is None:
+        return None
 
-# Configure paths
-pytesseract.pytesseract.tesseract_cmd = '/usr/bin/tesseract'
+    return description, int(quantity), unit_price, total_price
 
 class ReceiptProcessor:
     def __init__(self):
         self.debug = os.getenv('AI_DEBUG', 'false').lower() == 'true'
+        # Reprocessing the same receipt (retries, dry runs) yields identical
+        # text, so parse results are memoised per processor, keyed by the text
+        self._parse_cache: OrderedDict = OrderedDict()
+
+        from tesserocr import PyTessBaseAPI, PSM, OEM
+
+        # Load the Tesseract engine once and reuse it for every image
+        self._api = PyTessBaseAPI(psm=PSM.SINGLE_BLOCK, oem=OEM.DEFAULT)
+
+    def close(self):
+        """Release the Tesseract engine"""
+        api = getattr(self, '_api', None)
+        if api is not None:
+            api.End()
+            self._api = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        self.close()
 
     def preprocess_image(self, image_path: str) -> np.ndarray:
         """Preprocess image for better OCR results"""
-        try:
-            # Read image
-            image = cv2.imread(image_path)
+        import cv2
 
-            # Convert to grayscale
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-            # Apply thresholding
-            _, thresh = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY_INV)
+        try:
+            # Read image, letting the decoder convert straight to grayscale
+            gray = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+            if gray is None:
+                raise ValueError(f"could not read image {image_path}")
+
+            # Cap the long edge; OCR accuracy on receipts plateaus well below
+            # phone-camera resolution while Tesseract's cost grows with pixel count
+            height, width = gray.shape
+            scale = _MAX_IMAGE_EDGE / max(height, width)
+            if scale < 1.0:
+                size = (max(1, int(width * scale)), max(1, int(height * scale)))
+                gray = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+
+            # Apply thresholding; Otsu picks the cut-off from the image's own
+            # histogram and keeps dark text on a light background for Tesseract
+            _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
 
             # Remove noise
-            kernel = np.ones((1, 1), np.uint8)
-            processed = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel)
-            processed = cv2.medianBlur(processed, 3)
+            processed = cv2.medianBlur(thresh, 3)
 
             return processed
         except Exception as e:
@@ -45,12 +247,14 @@ class ReceiptProcessor:
 
     def extract_text(self, image: np.ndarray) -> str:
         """Extract text from image using Tesseract OCR"""
-        try:
-            # Configure Tesseract
-            custom_config = r'--oem 3 --psm 6'
+        import numpy as np
 
-            # Extract text
-            text = pytesseract.image_to_string(image, config=custom_config)
+        try:
+            # Hand the single-channel buffer to Tesseract directly, no PIL round-trip
+            image = np.ascontiguousarray(image, dtype=np.uint8)
+            height, width = image.shape
+            self._api.SetImageBytes(image.tobytes(), width, height, 1, width)
+            text = self._api.GetUTF8Text()
 
             if self.debug:
                 print("Extracted text:")
@@ -62,60 +266,27 @@ class ReceiptProcessor:
 
     def parse_date(self, text: str) -> Optional[str]:
         """Parse date from receipt text"""
-        date_patterns = [
-            r'\b\d{1,2}/\d{1,2}/\d{2,4}\b',  # MM/DD/YY or MM/DD/YYYY
-            r'\b\d{1,2}-\d{1,2}-\d{2,4}\b',  # MM-DD-YY or MM-DD-YYYY
-            r'\b\d{4}-\d{2}-\d{2}\b',         # YYYY-MM-DD
-            r'\b(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]* \d{1,2},? \d{4}\b',
-            r'\b\d{1,2} (Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]* \d{4}\b'
-        ]
-
-        for pattern in date_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                date_str = match.group(0)
-                try:
-                    # Try to parse the date
-                    if '/' in date_str:
-                        parsed = datetime.strptime(date_str, '%m/%d/%Y')
-                    elif '-' in date_str and len(date_str.split('-')[0]) == 4:
-                        parsed = datetime.strptime(date_str, '%Y-%m-%d')
-                    else:
-                        # Try various formats
-                        for fmt in ('%m-%d-%Y', '%d-%m-%Y', '%m/%d/%y', '%d/%m/%y'):
-                            try:
-                                parsed = datetime.strptime(date_str, fmt)
-                                break
-                            except ValueError:
-                                continue
-
-                    return parsed.strftime('%Y-%m-%d')
-                except ValueError:
-                    continue
-
-        return None
-
-    def parse_vendor(self, text: str) -> str:
-        """Extract vendor name from receipt text"""
-        # Look for common vendor patterns
-        patterns = [
-            r'(?i)(vendor|merchant|store|restaurant|cafe|shop):?\s*(.+)',
-            r'(?i)(thank you|visit again|welcome to)\s*(.+)',
-            r'^[A-Z][a-z]+(\s+[A-Z][a-z]+)*\s+(Inc|LLC|Corp|Ltd|Pty)\b',
-            r'^[A-Z][a-z]+(\s+[A-Z][a-z]+)*\s+(Restaurant|Cafe|Store|Market|Shop)\b'
-        ]
-
-        for pattern in patterns:
-            match = re.search(pattern, text, re.MULTILINE)
-            if match:
-                vendor = match.group(1).strip()
+        return self.scan_fields(text)[0]
+
+    def parse_vendor(self, lines: List[str]) -> str:
+        """Extract vendor name from the receipt's stripped, non-empty lines"""
+        # The vendor is almost always printed at the top, so look there first
+        head = '\n'.join(lines[:_VENDOR_HEAD_LINES])
+        for match in _VENDOR_UNION.finditer(head):
+            vendor = match.group(match.lastgroup).strip()
+            if len(vendor) > 2:
+                return vendor
+
+        # Company/business name lines further down, past the head already searched
+        if len(lines) > _VENDOR_HEAD_LINES:
+            tail = '\n'.join(lines[_VENDOR_HEAD_LINES:])
+            for match in _VENDOR_NAME_UNION.finditer(tail):
+                vendor = match.group(match.lastgroup).strip()
                 if len(vendor) > 2:
                     return vendor
 
         # Fallback: first few words
-        lines = text.split('\n')
         for line in lines[:3]:
-            line = line.strip()
             if len(line) > 2 and not line.startswith('Date:') and not line.startswith('Time:'):
                 return line
 
@@ -123,67 +294,97 @@ class ReceiptProcessor:
 
     def parse_total(self, text: str) -> float:
         """Extract total amount from receipt"""
-        # Look for total patterns
-        patterns = [
-            r'(?i)(total|amount|balance|due):?\s*[\$€£]?\s*([\d,]+\.\d{2})',
-            r'(?i)(subtotal|total|amount)\s*[\$€£]?\s*([\d,]+\.\d{2})',
-            r'[\$€£]?\s*([\d,]+\.\d{2})\s*(?i)(total|due|balance)'
-        ]
-
-        for pattern in patterns:
-            match = re.search(pattern, text)
-            if match:
-                amount_str = match.group(1).replace(',', '')
-                try:
-                    return float(amount_str)
-                except ValueError:
-                    continue
-
-        # Fallback: look for last amount
-        amounts = re.findall(r'[\$€£]?\s*([\d,]+\.\d{2})', text)
-        if amounts:
-            return float(amounts[-1].replace(',', ''))
-
-        return 0.0
+        return self.scan_fields(text)[1]
 
     def parse_payment_method(self, text: str) -> str:
         """Extract payment method from receipt"""
-        methods = ['cash', 'credit', 'debit', 'visa', 'mastercard', 'amex', 'discover',
-                   'paypal', 'venmo', 'apple pay', 'google pay', 'mobile pay']
+        return self.scan_fields(text)[2]
+
+    def scan_fields(self, text: str) -> Tuple[Optional[str], float, str]:
+        """Extract date, total and payment method in a single pass over the text"""
+        date = total = payment_method = last_amount = None
+
+        for match in _FIELDS_UNION.finditer(text):
+            kind = match.lastgroup
+            value = match.group(kind)
+
+            if kind in _DATE_FORMATS:
+                if date is None:
+                    date = _normalise_date(kind, value)
+            elif kind in _TOTAL_GROUPS:
+                if total is None:
+                    total = value
+            elif kind == 'payment':
+                if payment_method is None:
+                    payment_method = value.capitalize()
+            else:
+                last_amount = value
+
+            # The last-amount fallback is only needed while no total is known
+            if date and total and payment_method:
+                break
+
+        amount = total or last_amount
+        return (
+            date,
+            _amount_value(amount) if amount else 0.0,
+            payment_method or "Unknown"
+        )
+
+    def parse_items(self, lines: List[str]) -> List[Dict]:
+        """Extract line items from the receipt's stripped, non-empty lines"""
+        items = []
 
-        text_lower = text.lower()
+        for line in lines:
+            # Every item line has a "qty @ unit price" column; skip the rest outright
+            if '@' not in line:
+                continue
+
+            # Plain "description qty @ unit total" layout: column slicing, no regex
+            fields = _split_item_line(line)
+            if fields is None:
+                # OCR noise around the columns: fall back to the general pattern
+                match = _ITEM_PATTERN.match(line)
+                if not match:
+                    continue
+                fields = (
+                    match.group(1).strip(),
+                    int(match.group(2)),
+                    float(match.group(3).translate(_STRIP_COMMAS)),
+                    float(match.group(4).translate(_STRIP_COMMAS))
+                )
+
+            description, quantity, unit_price, total_price = fields
+            items.append({
+                'description': description,
+                'quantity': quantity,
+                'unit_price': unit_price,
+                'total_price': total_price,
+                'category': 'general'
+            })
 
-        for method in methods:
-            if method in text_lower:
-                return method.capitalize()
+        return items
 
-        return "Unknown"
+    def _parse_text(self, text: str) -> Tuple[str, Optional[str], float, str, Tuple[Dict, ...]]:
+        """Run every parser over one OCR text, reusing cached results"""
+        cached = self._parse_cache.get(text)
+        if cached is not None:
+            self._parse_cache.move_to_end(text)
+            return cached
 
-    def parse_items(self, text: str) -> List[Dict]:
-        """Extract line items from receipt"""
-        items = []
-        lines = text.split('\n')
+        # Split once and share the lines between parsers
+        lines = [line for line in (raw.strip() for raw in text.split('\n')) if line]
 
-        # Look for item patterns
-        item_pattern = r'([A-Za-z\s]+)\s+(\d+)\s+@\s+([\$€£]?\s*[\d,]+\.\d{2})\s+([\$€£]?\s*[\d,]+\.\d{2})'
+        vendor = self.parse_vendor(lines)
+        date, total, payment_method = self.scan_fields(text)
+        items = tuple(self.parse_items(lines))
 
-        for line in lines:
-            match = re.search(item_pattern, line)
-            if match:
-                description = match.group(1).strip()
-                quantity = int(match.group(2))
-                unit_price = float(match.group(3).replace('$', '').replace(',', ''))
-                total_price = float(match.group(4).replace('$', '').replace(',', ''))
-
-                items.append({
-                    'description': description,
-                    'quantity': quantity,
-                    'unit_price': unit_price,
-                    'total_price': total_price,
-                    'category': 'general'
-                })
-
-        return items
+        result = (vendor, date, total, payment_method, items)
+        self._parse_cache[text] = result
+        if len(self._parse_cache) > _PARSE_CACHE_SIZE:
+            # Drop the least recently used text
+            self._parse_cache.popitem(last=False)
+        return result
 
     def process_receipt(self, image_path: str) -> Dict:
         """Main processing method"""
@@ -195,11 +396,10 @@ class ReceiptProcessor:
             text = self.extract_text(processed_image)
 
             # Parse data
-            vendor = self.parse_vendor(text)
-            date = self.parse_date(text) or datetime.now().strftime('%Y-%m-%d')
-            total = self.parse_total(text)
-            payment_method = self.parse_payment_method(text)
-            items = self.parse_items(text)
+            vendor, date, total, payment_method, items = self._parse_text(text)
+            date = date or datetime.now().strftime('%Y-%m-%d')
+            # Cached results are shared, so hand out fresh item dicts
+            items = [dict(item) for item in items]
 
             # Calculate confidence (simplified)
             confidence = 0.95 if len(items) > 0 else 0.85
@@ -227,18 +427,77 @@ class ReceiptProcessor:
                 'items': []
             }
 
+_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp', '.webp')
+
+# Per-process processor used by batch workers
+_worker_processor: Optional[ReceiptProcessor] = None
+
+def _init_worker():
+    global _worker_processor
+    _worker_processor = ReceiptProcessor()
+
+def _process_in_worker(image_path: str) -> Dict:
+    return _worker_processor.process_receipt(image_path)
+
+def expand_image_paths(paths: List[str]) -> List[str]:
+    """Expand directories into the image files they contain"""
+    expanded = []
+    for path in paths:
+        if os.path.isdir(path):
+            expanded.extend(
+                os.path.join(path, name) for name in sorted(os.listdir(path))
+                if name.lower().endswith(_IMAGE_EXTENSIONS)
+            )
+        else:
+            expanded.append(path)
+    return expanded
+
+def process_batch(image_paths: List[str], processes: Optional[int] = None) -> List[Dict]:
+    """Process receipts in parallel, one single-threaded Tesseract per worker process"""
+    if not image_paths:
+        return []
+
+    processes = min(processes or os.cpu_count() or 1, len(image_paths))
+    with multiprocessing.Pool(processes=processes, initializer=_init_worker) as pool:
+        # imap keeps results in the same order as image_paths
+        return list(pool.imap(_process_in_worker, image_paths))
+
+def write_json(result) -> None:
+    """Write a result as one line of JSON on stdout"""
+    if orjson is None:
+        print(json.dumps(result))
+        return
+
+    try:
+        encoded = orjson.dumps(result, option=orjson.OPT_APPEND_NEWLINE)
+    except orjson.JSONEncodeError:
+        # e.g. integers wider than 64 bits, which the stdlib encoder still handles
+        print(json.dumps(result))
+        return
+
+    # Flush text-mode output (e.g. AI_DEBUG prints) before writing raw bytes
+    sys.stdout.flush()
+    sys.stdout.buffer.write(encoded)
+    sys.stdout.flush()
+
 def main():
     # Parse arguments
     parser = argparse.ArgumentParser(description='Process receipt image')
-    parser.add_argument('image_path', help='Path to receipt image')
+    inputs = parser.add_mutually_exclusive_group(required=True)
+    inputs.add_argument('image_path', nargs='?', help='Path to receipt image')
+    inputs.add_argument('--batch', nargs='+', metavar='PATH',
+                        help='Process several receipt images (or directories of them) in parallel')
     args = parser.parse_args()
 
     # Process receipt
-    processor = ReceiptProcessor()
-    result = processor.process_receipt(args.image_path)
+    if args.batch:
+        result = process_batch(expand_image_paths(args.batch))
+    else:
+        with ReceiptProcessor() as processor:
+            result = processor.process_receipt(args.image_path)
 
     # Output JSON result
-    print(json.dumps(result))
+    write_json(result)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,42 @@
+"""Tests for the receipt text parsers in ai/process_receipt.py"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'ai'))
+
+from process_receipt import ReceiptProcessor  # noqa: E402
+
+
+def make_processor():
+    # The parsers never touch the OCR engine, so skip __init__ and tesserocr
+    return ReceiptProcessor.__new__(ReceiptProcessor)
+
+
+class ScanFieldsTest(unittest.TestCase):
+    def test_total_ignores_preceding_subtotal(self):
+        text = "Corner Shop\nSubtotal 18.00\nTax 1.44\nTotal 19.44\nVisa"
+        date, total, payment_method = make_processor().scan_fields(text)
+        self.assertEqual(total, 19.44)
+        self.assertEqual(payment_method, 'Visa')
+
+
+class ParseVendorTest(unittest.TestCase):
+    def test_vendor_name_stays_on_one_line(self):
+        lines = ["Whole Foods", "Market", "12 Elm St", "Date: 01/02/2024"]
+        self.assertEqual(make_processor().parse_vendor(lines), 'Whole Foods')
+
+
+class ParseItemsTest(unittest.TestCase):
+    def test_price_allows_a_single_currency_symbol(self):
+        items = make_processor().parse_items(["Eggs 1 @ $2.00 $2.00", "Milk 1 @ $$2.00 2.00"])
+        self.assertEqual([item['description'] for item in items], ['Eggs'])
+
+    def test_large_quantities_are_kept(self):
+        items = make_processor().parse_items(["Screws 10000 @ 0.01 100.00", "Nails 25000 @ $ 0.01 250.00"])
+        self.assertEqual([item['quantity'] for item in items], [10000, 25000])
+
+
+if __name__ == '__main__':
+    unittest.main()